@@ -10,91 +10,296 @@ Date: 2025-10-31
 """
 
 import os
+import sys
 import csv
+import argparse
+import re
+import asyncio
 import json
+import functools
+import hashlib
 import webbrowser
-from typing import List, Dict, Any
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Dict, Any, Optional
 from urllib.parse import quote_plus
 
 import jinja2
 import ollama
+import orjson
 from json_repair import repair_json 
 
 # --- Configuration ---
 MODEL_NAME = 'llama3'
+MAX_CONCURRENCY = 8  # Upper bound on in-flight Ollama requests
+LLM_CACHE_SIZE = 4096  # Distinct prompts/queries remembered for de-duplication
+PARSE_WORKERS = 4  # Threads available for repairing malformed JSON
+KEEP_ALIVE = '30m'  # Keep the model resident between requests
+# num_ctx / num_thread are left to the server unless passed via llm_options
+LLM_OPTIONS = {
+    'num_batch': 1024,
+}
+# Structured-output schema passed to Ollama so responses are always {"query": "..."}
+QUERY_SCHEMA = {
+    'type': 'object',
+    'properties': {'query': {'type': 'string'}},
+    'required': ['query'],
+}
+COMPILED_TEMPLATE_DIR = 'compiled_templates'  # Output of compile_templates()
+FORMAT_STRINGS_FILE = 'format_strings.json'  # Written next to the compiled modules
+
+class _BlankDict(dict):
+    """Render context that yields '' for missing columns, like Jinja's Undefined."""
+    def __missing__(self, key):
+        return ''
+
+def _file_mtimes(directory: str) -> List[float]:
+    """Modification times of every file below a directory."""
+    return [os.path.getmtime(os.path.join(root, name))
+            for root, _, names in os.walk(directory) for name in names]
+
+def _newest_mtime(directory: str) -> float:
+    return max(_file_mtimes(directory), default=0.0)
+
+def _oldest_mtime(directory: str) -> float:
+    return min(_file_mtimes(directory), default=0.0)
+
+def _load_compiled_format_strings(compiled_template_dir: str) -> Dict[str, Optional[str]]:
+    """Reads the format strings written by compile_templates(); {} if absent."""
+    try:
+        with open(os.path.join(compiled_template_dir, FORMAT_STRINGS_FILE), 'rb') as f:
+            return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
 
 class UrlFinder:
     """Handles data loading, template merging, and communication with the LLM."""
-    def __init__(self, template_dir='templates', model_name=MODEL_NAME):
+    def __init__(self, template_dir='templates', model_name=MODEL_NAME,
+                 keep_alive=KEEP_ALIVE, llm_options=None,
+                 compiled_template_dir=COMPILED_TEMPLATE_DIR, ollama_host=None):
         self.template_dir = template_dir
         self.model_name = model_name
+        self.keep_alive = keep_alive
+        self.llm_options = LLM_OPTIONS if llm_options is None else llm_options
+        
+        # One shared client so every request reuses the same HTTP connection pool.
+        # A host of None lets ollama honour OLLAMA_HOST (default 127.0.0.1:11434).
+        self.client = ollama.AsyncClient(host=ollama_host)
+        self._responses: OrderedDict[str, asyncio.Future] = OrderedDict()
+        
+        # Import precompiled template modules when available; otherwise load
+        # from source and persist compiled bytecode so warm starts skip re-compiling
+        # (Jinja's default cache dir is per-user, mode 0700 and owner-checked).
+        use_compiled = os.path.isdir(compiled_template_dir)
+        if use_compiled and _newest_mtime(self.template_dir) > _oldest_mtime(compiled_template_dir):
+            print(f"Warning: '{compiled_template_dir}' is older than '{self.template_dir}'; "
+                  f"loading templates from source. Re-run compile_templates() to refresh it.",
+                  file=sys.stderr)
+            use_compiled = False
+        if use_compiled:
+            loader = jinja2.ModuleLoader(compiled_template_dir)
+            bytecode_cache = None
+            self._loader_dir = compiled_template_dir
+            self._compiled_format_strings = _load_compiled_format_strings(compiled_template_dir)
+        else:
+            loader = jinja2.FileSystemLoader(self.template_dir)
+            bytecode_cache = jinja2.FileSystemBytecodeCache()
+            self._loader_dir = self.template_dir
+            self._compiled_format_strings = None
         self.env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(self.template_dir),
+            loader=loader,
+            bytecode_cache=bytecode_cache,
+            auto_reload=False,
         )
+        self._templates: Dict[str, jinja2.Template] = {}
+        self._format_renderers: Dict[str, Optional[Callable[[Dict[str, Any]], str]]] = {}
         
     def get_template(self, template_name: str) -> jinja2.Template:
-        """Loads the Jinja2 template by name."""
+        """Loads the Jinja2 template by name, reusing it on subsequent calls."""
+        template = self._templates.get(template_name)
+        if template is not None:
+            return template
         try:
-            return self.env.get_template(template_name)
+            template = self._templates[template_name] = self.env.get_template(template_name)
+            return template
         except jinja2.TemplateNotFound:
-            raise FileNotFoundError(f"Template '{template_name}' not found in directory '{self.template_dir}'")
+            raise FileNotFoundError(f"Template '{template_name}' not found in directory '{self._loader_dir}'")
     
-    def load_data_from_csv(self, file_path: str) -> List[Dict[str, Any]]:
-        """Reads a CSV file (with headers) and returns a list of dictionaries."""
-        data = []
+    def _read_csv_rows(self, file_path: str) -> Iterator[List[str]]:
+        """Streams the raw, non-blank rows of a CSV file; the first row is the header."""
         try:
             with open(file_path, mode='r', newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    data.append(row)
+                for row in csv.reader(csvfile):
+                    if row:
+                        yield row
         except FileNotFoundError:
             raise FileNotFoundError(f"CSV file '{file_path}' not found.")
-        return data
     
-    def merge_template_and_data(self, template_name: str, data_file: str) -> List[str]:
-        """Loads data, loads the template, and renders the template once for each data row."""
-        data_rows = self.load_data_from_csv(data_file)
+    def load_data_from_csv(self, file_path: str) -> Iterator[Dict[str, Any]]:
+        """Streams a CSV file (with headers), yielding one dictionary per row."""
+        rows = self._read_csv_rows(file_path)
+        header = tuple(next(rows, ()))
+        for row in rows:
+            yield dict(zip(header, row))
+    
+    def merge_template_and_data(self, template_name: str, data_file: str) -> Iterator[str]:
+        """Loads the template and lazily renders it once for each data row."""
         template = self.get_template(template_name)
         
-        rendered_outputs = []
-        for row_data in data_rows:
-            output = template.render(**row_data)
-            rendered_outputs.append(output)
-            
-        return rendered_outputs
+        # Plain substitution templates skip Jinja and render via str.format_map
+        render = self._get_format_renderer(template_name) or template.render
+        return self._render_rows(render, self._read_csv_rows(data_file))
+    
+    def _get_format_renderer(self, template_name: str) -> Optional[Callable[[Dict[str, Any]], str]]:
+        """
+        Returns a str.format_map renderer equivalent to the template when it only
+        contains literal text and bare {{ variable }} substitutions, else None.
+        """
+        if template_name not in self._format_renderers:
+            format_string = self._load_format_string(template_name)
+            self._format_renderers[template_name] = format_string.format_map if format_string is not None else None
+        return self._format_renderers[template_name]
+    
+    def _load_format_string(self, template_name: str) -> Optional[str]:
+        """
+        Looks up the template's precomputed format string: from the
+        compile_templates() output when precompiled modules are in use, else from
+        the bytecode cache directory, keyed by a checksum of the template source.
+        The template is only parsed on a cache miss.
+        """
+        if self._compiled_format_strings is not None:
+            return self._compiled_format_strings.get(template_name)
+        
+        try:
+            source, _, _ = self.env.loader.get_source(self.env, template_name)
+        except jinja2.TemplateNotFound:
+            return None
+        
+        checksum = hashlib.sha1(f"{template_name}\0{source}".encode('utf-8')).hexdigest()
+        cache_path = os.path.join(self.env.bytecode_cache.directory, f"urlfinder_fmt_{checksum}.json")
+        try:
+            with open(cache_path, 'rb') as f:
+                return orjson.loads(f.read())['format']
+        except (OSError, orjson.JSONDecodeError, KeyError, TypeError):
+            pass
+        
+        format_string = template_format_string(self.env, source)
+        try:
+            with open(cache_path, 'wb') as f:
+                f.write(orjson.dumps({'format': format_string}))
+        except OSError:
+            pass
+        return format_string
+    
+    @staticmethod
+    def _render_rows(render: Callable[[Dict[str, Any]], str], rows: Iterator[List[str]]) -> Iterator[str]:
+        """Renders each CSV row through a single context dict that is refilled in place."""
+        header = tuple(next(rows, ()))
+        context: Dict[str, Any] = _BlankDict()
+        for row in rows:
+            context.clear()
+            context.update(zip(header, row))
+            yield render(context)
+        
+    async def get_llm_response(self, user_prompt: str) -> str:
+        """
+        Returns the LLM response for a prompt. Identical prompts share a single
+        Ollama request, whether it is still in flight or already finished.
+        """
+        task = self._responses.get(user_prompt)
+        if task is None:
+            task = asyncio.ensure_future(self._chat(user_prompt))
+            self._responses[user_prompt] = task
+            if len(self._responses) > LLM_CACHE_SIZE:
+                self._responses.popitem(last=False)
+        else:
+            self._responses.move_to_end(user_prompt)
         
-    def get_llm_response(self, user_prompt: str) -> str:
+        # Shield the shared task so one cancelled caller doesn't cancel the others
+        response = await asyncio.shield(task)
+        if response.startswith("OLLAMA_ERROR:") and self._responses.get(user_prompt) is task:
+            # Don't cache failures; let a later duplicate retry
+            del self._responses[user_prompt]
+        return response
+    
+    async def _chat(self, user_prompt: str) -> str:
         """Calls the Ollama API to generate a structured search query."""
         try:
-            response = ollama.chat(
+            response = await self.client.chat(
                 model=self.model_name,
                 messages=[
                     {'role': 'user', 'content': user_prompt.strip()},
                 ],
-                format='json'  
+                format=QUERY_SCHEMA,
+                keep_alive=self.keep_alive,
+                options=self.llm_options,
             )
             return response['message']['content']
         except Exception as e:
             return f"OLLAMA_ERROR: {e}"
 
+def template_format_string(env: jinja2.Environment, source: str) -> Optional[str]:
+    """
+    Converts template source made only of literal text and bare {{ variable }}
+    outputs into an equivalent str.format_map string; returns None otherwise.
+    """
+    parts = []
+    for node in env.parse(source).body:
+        if not isinstance(node, jinja2.nodes.Output):
+            return None
+        for child in node.nodes:
+            if isinstance(child, jinja2.nodes.TemplateData):
+                parts.append(child.data.replace('{', '{{').replace('}', '}}'))
+            elif (isinstance(child, jinja2.nodes.Name) and child.name != 'self'
+                    and child.name not in env.globals):
+                parts.append('{' + child.name + '}')
+            else:
+                return None
+    return ''.join(parts)
+
+def compile_templates(template_dir='templates', target=COMPILED_TEMPLATE_DIR) -> None:
+    """
+    Precompiles every template into Python modules loadable by jinja2.ModuleLoader,
+    alongside the format strings used to render plain substitution templates.
+    """
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir))
+    env.compile_templates(target, zip=None)
+    
+    format_strings = {}
+    for name in env.list_templates():
+        source, _, _ = env.loader.get_source(env, name)
+        format_strings[name] = template_format_string(env, source)
+    with open(os.path.join(target, FORMAT_STRINGS_FILE), 'wb') as f:
+        f.write(orjson.dumps(format_strings))
+
 # --------------------------------------------------------------------
 # --- Search and Validation Functions ---
 # --------------------------------------------------------------------
 
+# Search URL templates, keyed by engine name
+_ENGINE_URLS = {
+    'google': 'https://www.google.com/search?q={}',
+    'bing': 'https://www.bing.com/search?q={}',
+    'duckduckgo': 'https://duckduckgo.com/?q={}',
+}
+
+# Matches a query-like key or value when a response lacks the 'query' key
+_QUERY_PAT = re.compile(r'Reviews|Query').search
+
+# Confidence label for 0, 1, 2 and 3 engine matches
+_CONFIDENCE_LEVELS = ("LOW 🔴", "LOW 🔴", "MEDIUM 🟡", "HIGH 🟢")
+
 def create_search_url(query: str, engine: str) -> str:
     """Safely URL-encodes the query and builds a direct search link."""
+    url_template = _ENGINE_URLS.get(engine)
+    return url_template.format(quote_plus(query)) if url_template else ""
+
+def build_all_urls(query: str) -> Dict[str, str]:
+    """URL-encodes the query once and builds a search link for every engine."""
     safe_query = quote_plus(query)
-    
-    if engine == 'google':
-        return f"https://www.google.com/search?q={safe_query}"
-    elif engine == 'bing':
-        return f"https://www.bing.com/search?q={safe_query}"
-    elif engine == 'duckduckgo':
-        return f"https://duckduckgo.com/?q={safe_query}"
-    else:
-        return ""
+    return {engine: url_template.format(safe_query) for engine, url_template in _ENGINE_URLS.items()}
 
-def simulate_search_result(query: str, engine: str) -> bool:
+def simulate_search_results(query: str) -> tuple[bool, bool, bool]:
     """
     *** TEMPORARY MOCK FUNCTION ***
     
@@ -105,121 +310,216 @@ def simulate_search_result(query: str, engine: str) -> bool:
     When a search API key is available, this entire function must be replaced
     by an actual API call (e.g., Google Custom Search API) that retrieves
     the top search results and checks if the 'G2 Reviews' link exists.
+
+    The query is expected to be lowercased already (see assess_confidence).
+    Returns the (google, bing, duckduckgo) outcomes.
     """
-    query = query.lower()
+    # Scan for each token once and derive all engine outcomes from the flags
+    has_diebold = 'diebold' in query
+    has_paccar = 'paccar' in query
+    has_g2 = 'g2' in query
     
     # Simulation Logic (Designed to produce varied results for demonstration)
-    if engine == 'google':
-        return 'diebold' in query or 'paccar' in query
+    return (
+        has_diebold or has_paccar,
+        has_paccar and has_g2,
+        query == "diebold g2 reviews",
+    )
 
-    elif engine == 'bing':
-        return 'paccar' in query and 'g2' in query
-    
-    elif engine == 'duckduckgo':
-        return query == "diebold g2 reviews" 
-        
-    return False
+def simulate_search_result(query: str, engine: str) -> bool:
+    """Single-engine view of simulate_search_results, kept for existing callers."""
+    google, bing, duckduckgo = simulate_search_results(query.lower())
+    return {'google': google, 'bing': bing, 'duckduckgo': duckduckgo}.get(engine, False)
 
 def assess_confidence(query: str) -> tuple[str, str]:
     """
     Performs cross-validation against three search engines (simulated) 
     and assigns a confidence score based on source agreement.
     """
-    engines = ['google', 'bing', 'duckduckgo']
-    matches = []
-    
-    for engine in engines:
-        is_found = simulate_search_result(query, engine)
-        matches.append((engine, is_found))
-    
-    match_count = sum(1 for _, found in matches if found)
+    confidence, summary, _ = _score_query(query)
+    return confidence, summary
+
+@functools.lru_cache(maxsize=LLM_CACHE_SIZE)
+def _score_query(query: str) -> tuple[str, str, int]:
+    """Scores a query, returning (confidence, summary, match_count)."""
+    google, bing, duckduckgo = simulate_search_results(query.lower())
+    match_count = google + bing + duckduckgo
     
-    # Confidence Scoring Logic
-    if match_count == 3:
-        confidence = "HIGH 🟢"
-    elif match_count == 2:
-        confidence = "MEDIUM 🟡"
-    else:
-        confidence = "LOW 🔴"
+    # Confidence Scoring Logic (indexed by match count)
+    confidence = _CONFIDENCE_LEVELS[match_count]
 
-    summary = f"({match_count}/3 matches) — " + " | ".join([f"{e}: {'MATCH' if f else 'FAIL'}" for e, f in matches])
+    summary = (
+        f"({match_count}/3 matches) — google: {'MATCH' if google else 'FAIL'} | "
+        f"bing: {'MATCH' if bing else 'FAIL'} | duckduckgo: {'MATCH' if duckduckgo else 'FAIL'}"
+    )
     
-    return confidence, summary
+    return confidence, summary, match_count
 
 # --------------------------------------------------------------------
 # --- Main Execution ---
 # --------------------------------------------------------------------
 
-def main():
+def _repair_and_load(llm_response_str: str) -> Any:
+    """Repairs malformed JSON and parses it (CPU-bound; run off the event loop)."""
+    repaired_string = repair_json(llm_response_str)
+    return json.loads(repaired_string)
+
+async def process_llm_response(business_number: int, llm_response_str: str, pretty: bool = False) -> None:
+    """
+    Parses one LLM response, assesses the extracted query and writes the result
+    as a single JSONL record (or a human-readable report when pretty is set).
+    """
+    write_record(await build_record(business_number, llm_response_str), pretty)
+
+async def build_record(business_number: int, llm_response_str: str) -> Dict[str, Any]:
+    """Parses one LLM response and assesses the extracted query into a result record."""
+    record: Dict[str, Any] = {'business': business_number}
+    parsed_data = None
+    
+    if llm_response_str.startswith("OLLAMA_ERROR:"):
+        record['error'] = llm_response_str
+    else:
+        try:
+            # Attempt fast JSON parse (orjson tolerates surrounding whitespace)
+            parsed_data = orjson.loads(llm_response_str)
+            
+        except orjson.JSONDecodeError:
+            # Fallback to repair if standard parse fails, in a worker thread so
+            # a slow repair does not stall dispatch of other requests
+            try:
+                parsed_data = await asyncio.to_thread(_repair_and_load, llm_response_str)
+            except Exception:
+                record['error'] = "CRITICAL ERROR: Failed to parse or repair JSON."
+                record['raw'] = llm_response_str.strip()
+    
+    # A falsy parse result ({}, [], "") falls through to the extraction error
+    if 'error' not in record:
+        search_query = None
+        
+        # The schema puts the query under the 'query' key
+        if isinstance(parsed_data, dict):
+            search_query = parsed_data.get('query')
+            if not isinstance(search_query, str):
+                search_query = None
+            
+            # Fallback for output that ignored the schema (e.g. repaired JSON)
+            if not search_query:
+                for key, value in parsed_data.items():
+                    if isinstance(key, str) and _QUERY_PAT(key):
+                        search_query = key
+                        break
+                    if isinstance(value, str) and _QUERY_PAT(value):
+                        search_query = value
+                        break
+        
+        if search_query:
+            # Confidence Assessment
+            confidence, summary, match_count = _score_query(search_query)
+            record.update(
+                query=search_query,
+                confidence=confidence,
+                matches=match_count,
+                summary=summary,
+                urls=build_all_urls(search_query),
+            )
+        else:
+            record['error'] = "Could not reliably extract the query."
+            record['data'] = parsed_data
+    
+    return record
+
+def write_record(record: Dict[str, Any], pretty: bool = False) -> None:
+    """Emits one result record (JSONL or human-readable) with a single write."""
+    if pretty:
+        sys.stdout.write(format_report(record))
+    elif hasattr(sys.stdout, 'buffer'):
+        sys.stdout.buffer.write(orjson.dumps(record) + b"\n")
+    else:
+        # Text-only streams (e.g. a redirected StringIO) have no byte buffer
+        sys.stdout.write(orjson.dumps(record).decode() + "\n")
+
+def format_report(record: Dict[str, Any]) -> str:
+    """Renders a result record as the multi-line, human-readable report."""
+    lines = [f"\n--- Processing Business {record['business']} ---"]
+    
+    if 'query' in record:
+        lines.append(f"Extracted Query: {record['query']}")
+        lines.append(f"\n[ Confidence: {record['confidence']} ]")
+        lines.append(f"Validation Summary: {record['summary']}")
+        
+        # Display the links for manual validation
+        urls = record['urls']
+        lines.append("\nVerification Links (Copy & Paste to Check):")
+        lines.append(f"  Google: {urls['google']}")
+        lines.append(f"  Bing: {urls['bing']}")
+        lines.append(f"  DuckDuckGo: {urls['duckduckgo']}")
+    elif 'raw' in record:
+        lines.append(f"{record['error']} Raw output:\n{record['raw']}")
+    elif 'data' in record:
+        lines.append(f"{record['error']} Data received: {record['data']}")
+    elif 'error' in record:
+        lines.append(record['error'])
+    
+    return "\n".join(lines) + "\n"
+
+async def main(pretty: bool = False):
     finder = UrlFinder()
     
     template_name = 'instructions.txt'
     data_file = 'businesses.txt'
     
-    print(f"Loading data from '{data_file}' and template '{template_name}'...")
+    # Keep stdout clean for JSONL records; status messages go to stderr
+    status_out = sys.stdout if pretty else sys.stderr
+    
+    print(f"Loading data from '{data_file}' and template '{template_name}'...", file=status_out)
+    
+    # Bound the threads used for off-loop JSON repair
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=PARSE_WORKERS))
     
     try:
-        rendered_prompts = finder.merge_template_and_data(template_name, data_file)
+        # Rows are read and rendered lazily; workers pull from the shared stream
+        rendered_prompts = enumerate(finder.merge_template_and_data(template_name, data_file), start=1)
         
-        for i, prompt in enumerate(rendered_prompts):
-            print(f"\n--- Processing Business {i + 1} ---")
-            
-            llm_response_str = finder.get_llm_response(prompt)
-            
-            if llm_response_str.startswith("OLLAMA_ERROR:"):
-                print(llm_response_str)
-                continue
-                
-            parsed_data = None
-
-            try:
-                # Attempt standard JSON parse
-                parsed_data = json.loads(llm_response_str.strip())
-                
-            except json.JSONDecodeError:
-                # Fallback to repair if standard parse fails
+        # JSONL records carry their business number and are written as soon as
+        # they are ready; --pretty reports are held back and printed in input order
+        pending: Dict[int, Dict[str, Any]] = {}
+        next_number = 1
+        
+        def emit(record: Dict[str, Any]) -> None:
+            nonlocal next_number
+            if not pretty:
+                write_record(record)
+                return
+            pending[record['business']] = record
+            while next_number in pending:
+                write_record(pending.pop(next_number), pretty)
+                next_number += 1
+        
+        async def worker():
+            for business_number, prompt in rendered_prompts:
+                # Contain per-row failures so one bad response can't abort the run
                 try:
-                    repaired_string = repair_json(llm_response_str.strip())
-                    parsed_data = json.loads(repaired_string)
-                except Exception:
-                    print(f"CRITICAL ERROR: Failed to parse or repair JSON. Raw output:\n{llm_response_str.strip()}")
-                    parsed_data = None 
-            
-            
-            if parsed_data:
-                search_query = None
-                
-                # Extract the query key/value pair
-                if isinstance(parsed_data, dict):
-                    for key, value in parsed_data.items():
-                        if isinstance(key, str) and ("Reviews" in key or "Query" in key):
-                            search_query = key 
-                            break
-                        if isinstance(value, str) and ("Reviews" in value or "Query" in value):
-                            search_query = value
-                            break
-                
-                if search_query:
-                    print(f"Extracted Query: {search_query}")
-                    
-                    # Confidence Assessment
-                    confidence, summary = assess_confidence(search_query)
-                    print(f"\n[ Confidence: {confidence} ]")
-                    print(f"Validation Summary: {summary}")
-                    
-                    # Display the links for manual validation
-                    print("\nVerification Links (Copy & Paste to Check):")
-                    print(f"  Google: {create_search_url(search_query, 'google')}")
-                    print(f"  Bing: {create_search_url(search_query, 'bing')}")
-                    print(f"  DuckDuckGo: {create_search_url(search_query, 'duckduckgo')}")
-                    
-                else:
-                    print(f"Could not reliably extract the query. Data received: {parsed_data}")
+                    llm_response_str = await finder.get_llm_response(prompt)
+                    emit(await build_record(business_number, llm_response_str))
+                except Exception as e:
+                    emit({'business': business_number, 'error': f"An unexpected error occurred: {e}"})
+        
+        # A fixed pool of workers bounds the number of in-flight Ollama requests
+        try:
+            await asyncio.gather(*(worker() for _ in range(MAX_CONCURRENCY)))
+        finally:
+            # If the run was cut short, still print whatever reports were held back
+            for business_number in sorted(pending):
+                write_record(pending[business_number], pretty)
         
     except FileNotFoundError as e:
-        print(f"Error: {e}")
+        print(f"Error: {e}", file=status_out)
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+        print(f"An unexpected error occurred: {e}", file=status_out)
         
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate and validate search queries with a local LLM.")
+    parser.add_argument('--pretty', action='store_true',
+                        help="print human-readable reports instead of one JSON record per line")
+    args = parser.parse_args()
+    asyncio.run(main(pretty=args.pretty))
\ No newline at end of file